@@ -1,7 +1,9 @@
 # Copyright (c) 2024 Jonathan S. Pollack (https://github.com/JPPhoto)
 
+import threading
 from typing import Literal
 
+import numba
 import numpy as np
 from PIL import Image
 
@@ -15,6 +17,125 @@ from invokeai.invocation_api import (
     invocation,
 )
 
+# per-thread working buffers, kept between calls so same-sized seams don't reallocate them. They cost 5 bytes
+# per pixel, so only seams up to _SCRATCH_MAX_PIXELS (20 MB of buffers) are kept around.
+_scratch = threading.local()
+_SCRATCH_MAX_PIXELS = 4_000_000
+
+
+def _get_scratch(shape):
+    """Returns (energy, back) working buffers of the given shape, reusing the cached pair when the shape matches.
+    Larger seams get fresh buffers that are dropped with the call, along with any smaller cached pair."""
+    buffers = getattr(_scratch, "buffers", None)
+    if buffers is not None and buffers[0].shape == shape:
+        return buffers
+
+    buffers = (np.empty(shape, dtype=np.float32), np.empty(shape, dtype=np.int8))
+    _scratch.buffers = buffers if shape[0] * shape[1] <= _SCRATCH_MAX_PIXELS else None
+    return buffers
+
+
+# arrays backed by a PIL image are read-only
+_READONLY_L = numba.types.Array(numba.types.uint8, 2, "C", readonly=True)
+_READONLY_RGB = numba.types.Array(numba.types.uint8, 3, "C", readonly=True)
+
+
+@numba.njit(numba.void(_READONLY_L, _READONLY_L, numba.float32[:, ::1]), cache=True, fastmath=True)
+def _diff_luminance_l(l1, l2, out):
+    """Writes the grayscale image l2 minus l1, scaled to 0..1, into out"""
+    max_y, max_x = out.shape
+    scale = np.float32(1.0 / 255.0)
+
+    for y in range(max_y):
+        for x in range(max_x):
+            out[y, x] = (np.float32(l2[y, x]) - np.float32(l1[y, x])) * scale
+
+
+@numba.njit(numba.void(_READONLY_RGB, _READONLY_RGB, numba.float32[:, ::1]), cache=True, fastmath=True)
+def _diff_luminance_rgb(rgb1, rgb2, out):
+    """Writes the luminance of rgb2 minus the luminance of rgb1 into out, reading both images in one pass"""
+    max_y, max_x = out.shape
+    scale = np.float32(1.0 / (3.0 * 255.0))
+
+    for y in range(max_y):
+        for x in range(max_x):
+            l1 = np.float32(rgb1[y, x, 0]) + np.float32(rgb1[y, x, 1]) + np.float32(rgb1[y, x, 2])
+            l2 = np.float32(rgb2[y, x, 0]) + np.float32(rgb2[y, x, 1]) + np.float32(rgb2[y, x, 2])
+            out[y, x] = (l2 - l1) * scale
+
+
+@numba.njit("void(float32[:, ::1], float32[:, ::1])", cache=True, fastmath=True)
+def _compute_energy(ia, energy):
+    """Writes the sum of the absolute vertical and horizontal differences at each cell into energy in a single
+    pass. Forward differences are used everywhere except the last row and column, which fall back to backward
+    differences."""
+    max_y, max_x = ia.shape
+
+    for y in range(max_y):
+        ny = y + 1 if y < max_y - 1 else y
+        py = y if y < max_y - 1 else max(y - 1, 0)
+        for x in range(max_x):
+            nx = x + 1 if x < max_x - 1 else x
+            px = x if x < max_x - 1 else max(x - 1, 0)
+            energy[y, x] = abs(ia[ny, x] - ia[py, x]) + abs(ia[y, nx] - ia[y, px])
+
+
+@numba.njit("void(float32[:, ::1], int8[:, ::1])", cache=True, fastmath=True)
+def _compute_cumulative(energy, back):
+    """Sweeps the energy array top to bottom, accumulating the cheapest path into each cell in place. back is
+    filled with the direction (-1, 0, or +1) taken from the row above to reach each cell."""
+    max_y, max_x = energy.shape
+    back[0, :] = 0
+
+    if max_x == 1:
+        for y in range(1, max_y):
+            energy[y, 0] += energy[y - 1, 0]
+            back[y, 0] = 0
+        return
+
+    last = max_x - 1
+    for y in range(1, max_y):
+        # the edge columns only have two neighbours above them; ties go straight up
+        if energy[y - 1, 1] < energy[y - 1, 0]:
+            energy[y, 0] += energy[y - 1, 1]
+            back[y, 0] = 1
+        else:
+            energy[y, 0] += energy[y - 1, 0]
+            back[y, 0] = 0
+
+        for x in range(1, last):
+            best = energy[y - 1, x]
+            step = 0
+            if energy[y - 1, x - 1] < best:
+                best = energy[y - 1, x - 1]
+                step = -1
+            if energy[y - 1, x + 1] < best:
+                best = energy[y - 1, x + 1]
+                step = 1
+            energy[y, x] += best
+            back[y, x] = step
+
+        if energy[y - 1, last - 1] < energy[y - 1, last]:
+            energy[y, last] += energy[y - 1, last - 1]
+            back[y, last] = -1
+        else:
+            energy[y, last] += energy[y - 1, last]
+            back[y, last] = 0
+
+
+@numba.njit("uint16[::1](int8[:, ::1], int64)", cache=True)
+def _backtrack(back, lowest_pos):
+    """Follows the direction table from the bottom row back up to the top row"""
+    max_y = back.shape[0]
+    lowest_energy_line = np.empty(max_y, np.uint16)
+    lowest_energy_line[max_y - 1] = lowest_pos
+
+    for y in range(max_y - 2, -1, -1):
+        x = lowest_energy_line[y + 1]
+        lowest_energy_line[y] = x + back[y + 1, x]
+
+    return lowest_energy_line
+
 
 @invocation("smart_seam", title="Smart Seam", tags=["image"], version="1.0.1")
 class SmartSeamInvocation(BaseInvocation, WithMetadata):
@@ -24,82 +145,48 @@ class SmartSeamInvocation(BaseInvocation, WithMetadata):
     right_bottom_image: ImageField = InputField(description="The right or bottom image", title="Right/Bottom Image")
     mode: Literal[("Left/Right", "Top/Bottom")] = InputField(default="Left/Right", description="Seam direction")
 
-    def shift(self, arr, num, fill_value=255.0):
-        result = np.empty_like(arr)
-        if num > 0:
-            result[:num] = fill_value
-            result[num:] = arr[:-num]
-        elif num < 0:
-            result[num:] = fill_value
-            result[:num] = arr[-num:]
-        else:
-            result[:] = arr
-        return result
-
     def get_seam_line(self, i1: Image, i2: Image, rotate: bool) -> Image:
-        ia1 = np.array(i1) / 255.0
-        if i1.mode != "L":
-            ia1 = np.sum(ia1, -1) / 3.0
+        if i1.size != i2.size:
+            raise ValueError(f"Images must be the same size, got {i1.size} and {i2.size}")
 
-        ia2 = np.array(i2) / 255.0
-        if i2.mode != "L":
-            ia2 = np.sum(ia2, -1) / 3.0
+        # bring both images to a common mode the kernels understand, then pick the matching kernel once
+        if i1.mode != "L" or i2.mode != "L":
+            i1 = i1 if i1.mode == "RGB" else i1.convert("RGB")
+            i2 = i2 if i2.mode == "RGB" else i2.convert("RGB")
+        diff_luminance = _diff_luminance_l if i1.mode == "L" else _diff_luminance_rgb
 
-        ia = ia2 - ia1
+        ia = np.empty((i1.height, i1.width), dtype=np.float32)
+        diff_luminance(np.asarray(i1, dtype=np.uint8), np.asarray(i2, dtype=np.uint8), ia)
 
+        # a top/bottom seam is a left/right seam through the transposed image; copy the transpose so the
+        # kernels below still walk memory in order
         if rotate:
-            ia = np.rot90(ia, 1)
+            ia = np.ascontiguousarray(ia.T)
 
         # array is y by x
         max_y, max_x = ia.shape
 
-        energy = abs(np.gradient(ia, axis=0)) + abs(np.gradient(ia, axis=1))
+        # everything stays float32; seam energies don't need double precision
+        energy, back = _get_scratch((max_y, max_x))
+        _compute_energy(ia, energy)
+        _compute_cumulative(energy, back)
 
-        res = np.copy(energy)
+        # energy now holds the cumulative cost, so its last row gives the cheapest seam end; break ties toward the
+        # middle so a flat overlap still splits down the center instead of hugging an edge
+        bottom = energy[max_y - 1]
+        ties = np.flatnonzero(bottom == bottom.min())
+        lowest_pos = int(ties[np.argmin(np.abs(ties - max_x // 2))])
 
-        for y in range(1, max_y):
-            row = res[y, :]
-            rowl = self.shift(row, -1)
-            rowr = self.shift(row, 1)
-            res[y, :] = res[y - 1, :] + np.min([row, rowl, rowr], axis=0)
-
-        lowest_pos = int(max_x // 2)
-        lowest_value = res[max_y - 1, lowest_pos]
-        for x in range(0, max_x):
-            candidate = res[max_y - 1, x]
-            if candidate < lowest_value:
-                lowest_pos = x
-                lowest_value = candidate
-
-        # create an array max_y long
-        lowest_energy_line = np.empty([max_y], dtype="uint16")
-        lowest_energy_line[max_y - 1] = lowest_pos
-
-        for ypos in range(max_y - 2, -1, -1):
-            lowest_pos = lowest_energy_line[ypos + 1]
-            lpos = lowest_pos - 1 if lowest_pos > 1 else 0
-            rpos = lowest_pos + 1 if lowest_pos < (max_x - 1) else (max_x - 1)
-            yval = energy[ypos, lowest_pos]
-            yvall = energy[ypos, lowest_pos - 1] if lowest_pos > 1 else np.Inf
-            yvalr = energy[ypos, lowest_pos + 1] if lowest_pos < (max_x - 1) else np.Inf
-            # if the value to the left is lower energy, pick that path...
-            if yvall < yval and yvalr >= yval:
-                lowest_pos = lpos
-            # if the value to the right is lower energy, pick that path...
-            if yvalr < yval and yvall >= yval:
-                lowest_pos = rpos
-            lowest_energy_line[ypos] = lowest_pos
-
-        mask = np.zeros_like(ia)
-
-        for ypos in range(0, max_y):
-            to_fill = lowest_energy_line[ypos]
-            mask[ypos, 0:to_fill] = 1
+        lowest_energy_line = _backtrack(back, lowest_pos)
+
+        # everything left of the seam belongs to the first image
+        col_idx = np.arange(max_x, dtype=np.uint16)
+        mask = np.where(col_idx[None, :] < lowest_energy_line[:, None], np.uint8(255), np.uint8(0))
 
         if rotate:
-            mask = np.rot90(mask, 3)
+            mask = np.ascontiguousarray(mask.T)
 
-        image = Image.fromarray((mask * 255.0).astype("uint8"))
+        image = Image.fromarray(mask)
 
         return image
 
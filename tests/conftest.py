@@ -0,0 +1,37 @@
+import os
+import sys
+import types
+
+# the node lives at the repository root rather than in an installable package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import invokeai.invocation_api  # noqa: F401
+except ImportError:
+    # just enough of the InvokeAI node API for smart_seam to import and for get_seam_line to be called directly
+
+    class BaseInvocation:
+        @classmethod
+        def model_construct(cls, **kwargs):
+            return cls()
+
+    class WithMetadata:
+        pass
+
+    def InputField(default=None, **kwargs):
+        return default
+
+    def invocation(*args, **kwargs):
+        return lambda cls: cls
+
+    invocation_api = types.ModuleType("invokeai.invocation_api")
+    invocation_api.BaseInvocation = BaseInvocation
+    invocation_api.WithMetadata = WithMetadata
+    invocation_api.InputField = InputField
+    invocation_api.invocation = invocation
+    invocation_api.ImageField = invocation_api.ImageOutput = invocation_api.InvocationContext = object
+
+    invokeai = types.ModuleType("invokeai")
+    invokeai.invocation_api = invocation_api
+    sys.modules["invokeai"] = invokeai
+    sys.modules["invokeai.invocation_api"] = invocation_api
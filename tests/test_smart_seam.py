@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from smart_seam import SmartSeamInvocation, _backtrack, _compute_cumulative
+
+
+def reference_cumulative(energy):
+    """Plain Python seam DP: each cell adds the cheapest of its (up to) three neighbours in the row above"""
+    max_y, max_x = energy.shape
+    res = energy.astype(np.float64)
+    for y in range(1, max_y):
+        for x in range(max_x):
+            res[y, x] += min(res[y - 1, max(x - 1, 0) : min(x + 2, max_x)])
+    return res
+
+
+def run_dp(energy):
+    res = energy.copy()
+    back = np.empty(energy.shape, dtype=np.int8)
+    _compute_cumulative(res, back)
+    return res, back
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (1, 7), (7, 1), (2, 2), (9, 13), (40, 25)])
+def test_compute_cumulative_matches_reference(shape):
+    rng = np.random.default_rng(shape[0] * 100 + shape[1])
+    for _ in range(20):
+        energy = rng.random(shape, dtype=np.float32)
+        res, back = run_dp(energy)
+        np.testing.assert_allclose(res, reference_cumulative(energy), rtol=1e-5)
+        assert set(np.unique(back)) <= {-1, 0, 1}
+
+
+@pytest.mark.parametrize("shape", [(1, 5), (6, 1), (9, 13), (40, 25)])
+def test_backtrack_follows_cheapest_seam(shape):
+    rng = np.random.default_rng(shape[0] * 100 + shape[1])
+    for _ in range(20):
+        energy = rng.random(shape, dtype=np.float32)
+        res, back = run_dp(energy)
+        lowest_pos = int(np.argmin(res[-1]))
+
+        line = _backtrack(back, lowest_pos)
+
+        assert line[-1] == lowest_pos
+        assert np.all(line < shape[1])
+        assert np.all(np.abs(np.diff(line.astype(np.int64))) <= 1)
+        path_cost = energy[np.arange(shape[0]), line].astype(np.float64).sum()
+        assert path_cost == pytest.approx(reference_cumulative(energy)[-1].min(), rel=1e-5)
+
+
+def random_image(rng, mode, width, height):
+    shape = (height, width) if mode == "L" else (height, width, 3)
+    return Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8), mode)
+
+
+def seam_positions(mask, rotate):
+    """Number of first-image pixels before the seam along each row (or column, for a top/bottom seam)"""
+    filled = np.asarray(mask) == 255
+    if rotate:
+        filled = filled.T
+    # the first image's side must be one contiguous run from the start of each line
+    counts = filled.sum(axis=1)
+    assert np.array_equal(filled, np.arange(filled.shape[1])[None, :] < counts[:, None])
+    return counts
+
+
+@pytest.mark.parametrize("modes", [("L", "L"), ("RGB", "RGB"), ("L", "RGB"), ("RGBA", "RGB")])
+@pytest.mark.parametrize("size", [(31, 17), (1, 9), (9, 1), (1, 1)])
+@pytest.mark.parametrize("rotate", [False, True])
+def test_get_seam_line(modes, size, rotate):
+    rng = np.random.default_rng(0)
+    width, height = size
+    i1 = random_image(rng, "RGB", width, height).convert(modes[0])
+    i2 = random_image(rng, "RGB", width, height).convert(modes[1])
+
+    mask = SmartSeamInvocation.model_construct().get_seam_line(i1, i2, rotate)
+
+    assert mask.mode == "L"
+    assert mask.size == size
+    assert set(np.unique(np.asarray(mask))) <= {0, 255}
+    counts = seam_positions(mask, rotate)
+    assert np.all(np.abs(np.diff(counts.astype(np.int64))) <= 1)
+
+
+@pytest.mark.parametrize("rotate", [False, True])
+def test_get_seam_line_splits_identical_images_down_the_middle(rotate):
+    image = random_image(np.random.default_rng(0), "RGB", 20, 20)
+
+    mask = SmartSeamInvocation.model_construct().get_seam_line(image, image.copy(), rotate)
+
+    assert np.all(seam_positions(mask, rotate) == 10)
+
+
+def test_get_seam_line_rejects_mismatched_sizes():
+    rng = np.random.default_rng(0)
+    with pytest.raises(ValueError):
+        SmartSeamInvocation.model_construct().get_seam_line(
+            random_image(rng, "RGB", 8, 8), random_image(rng, "RGB", 8, 9), False
+        )